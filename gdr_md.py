@@ -1,9 +1,16 @@
+import functools
+import io
 import os.path
 import re
+import sys
+import threading
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
 # Required Google Libraries
 try:
+    import google_auth_httplib2
+    import httplib2
     from google.auth.transport.requests import Request
     from google.oauth2.credentials import Credentials
     from google_auth_oauthlib.flow import InstalledAppFlow
@@ -17,10 +24,55 @@ except ImportError:
 # Scope for read-only access to Google Docs
 SCOPES = ["https://www.googleapis.com/auth/documents.readonly"]
 
+# Response field mask: only the parts of the document the converter reads
+DOC_FIELDS = (
+    "title,"
+    "body(content(paragraph("
+    "elements(textRun(content,textStyle/link),footnoteReference(footnoteId,footnoteNumber)),"
+    "paragraphStyle/namedStyleType))),"
+    "footnotes"
+)
+
+# Precompiled patterns used during conversion
+_DISPLAY_MATH_RE = re.compile(r'\$\$.*?\$\$', re.DOTALL)
+# Inline math between pipes: character classes stop each attempt at the next pipe,
+# so pipe-heavy text (e.g. tables) is scanned in linear time without backtracking.
+_INLINE_MATH_RE = re.compile(r'\|[^|\\]*\\[^|]*\|')
+_EOR_RE = re.compile(r'End of Report', re.IGNORECASE)
+_UNDERSCORE_RE = re.compile(r'(?<!\\)_')
+
+# Returned by process_paragraph in place of text when conversion should stop
+_STOP = object()
+
+# Headings (lowercased) that mark the start of the bibliography; conversion stops there
+_STOP_HEADINGS = frozenset({"works cited", "references", "bibliography"})
+
+# Markdown prefixes for Google Docs paragraph styles.
+# Google Docs often uses H1 for the main title, so TITLE maps to '#' as well.
+_HEADING_PREFIX = {
+    'TITLE': '#',
+    'HEADING_1': '#',
+    'HEADING_2': '##',
+    'HEADING_3': '###',
+    'HEADING_4': '####',
+    'HEADING_5': '#####',
+    'HEADING_6': '######',
+    'NORMAL_TEXT': '',
+}
+
 # --- Authentication ---
 
+# Credentials reused by later calls in the same process
+_CREDS = None
+
 def authenticate():
     """Handles Google OAuth 2.0 authentication for a desktop application."""
+    global _CREDS
+    # Within a process, the authorized transport refreshes cached credentials
+    # on demand (and retries on 401), so there is no need to touch token.json again.
+    if _CREDS is not None and (_CREDS.valid or _CREDS.refresh_token):
+        return _CREDS
+
     creds = None
     # The file token.json stores the user's access and refresh tokens.
     if os.path.exists("token.json"):
@@ -49,172 +101,253 @@ def authenticate():
         # Save the credentials for the next run
         with open("token.json", "w") as token:
             token.write(creds.to_json())
+    _CREDS = creds
     return creds
 
+# Built API clients, keyed by API name
+_SERVICE_CACHE = {}
+
+def get_service():
+    """Returns a Docs API client, authenticating and building it on first use."""
+    if 'docs' not in _SERVICE_CACHE:
+        creds = authenticate()
+        if not creds:
+            return None
+        # The discovery document bundled with the library avoids a network fetch here.
+        _SERVICE_CACHE['docs'] = build("docs", "v1", credentials=creds, static_discovery=True)
+    return _SERVICE_CACHE['docs']
+
 # --- Helper Functions ---
 
+@functools.lru_cache(maxsize=4096)
 def clean_google_url(url):
     """Cleans Google redirect URLs by extracting the 'q' parameter."""
     # Even in the API, Google often wraps URLs in redirects.
-    if url and "google.com/url?q=" in url:
-        parsed_url = urllib.parse.urlparse(url)
-        query_params = urllib.parse.parse_qs(parsed_url.query)
-        if 'q' in query_params:
-            return query_params['q'][0]
-    return url
+    if not url or "google.com/url?q=" not in url:
+        return url
+    # The target is always the leading 'q' parameter; slice it out directly
+    start = url.find("google.com/url?q=") + len("google.com/url?q=")
+    end = url.find("&", start)
+    target = url[start:] if end == -1 else url[start:end]
+    return urllib.parse.unquote_plus(target.split('#', 1)[0])
 
 def apply_linking_heuristic(text_before, url):
     """Applies the heuristic: Link the phrase after the last comma in the last sentence."""
-    text = text_before.strip()
-    if not text:
+    # Work with index cursors into text_before rather than stripped/sliced copies.
+    text = text_before
+    start, end = 0, len(text)
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end-1].isspace():
+        end -= 1
+    if start == end:
         return ""
 
     # Handle trailing punctuation (e.g., the period just before the footnote)
     trailing_punctuation = ""
-    if text.endswith(('.', ',', ';', ':')):
-        trailing_punctuation = text[-1]
-        text = text[:-1].strip()
+    if text[end-1] in '.,;:':
+        trailing_punctuation = text[end-1]
+        end -= 1
+        while end > start and text[end-1].isspace():
+            end -= 1
+        # Nothing left to link if the buffer was just punctuation
+        if start == end:
+            return trailing_punctuation
 
     # 1. Find the start of the last sentence (after ". ").
-    last_period_index = text.rfind('. ')
-
+    last_period_index = text.rfind('. ', start, end)
     if last_period_index != -1:
         # Include the ". " in the preceding text
-        text_before_sentence = text[:last_period_index+2]
-        last_sentence = text[last_period_index+2:].strip()
+        text_before_sentence = text[start:last_period_index+2]
+        sentence_start = last_period_index + 2
+        while text[sentence_start].isspace():
+            sentence_start += 1
     else:
         text_before_sentence = ""
-        last_sentence = text.strip()
-
-    # If the last sentence is empty, link the text before it as a fallback
-    if not last_sentence:
-         # Ensure we don't link empty text if the buffer was just punctuation
-         if not text_before_sentence.strip() and not text.strip():
-             return trailing_punctuation
-         # Link the remaining text (which is 'text' variable after punctuation removal)
-         return f"[{text.strip()}]({url}){trailing_punctuation}"
+        sentence_start = start
 
     # 2. Find the last comma in the last sentence (", ").
-    last_comma_index = last_sentence.rfind(', ')
+    last_comma_index = text.rfind(', ', sentence_start, end)
 
     if last_comma_index != -1:
-        # Include the ", " in the preceding text
-        text_before_phrase = last_sentence[:last_comma_index+2]
-        linked_phrase = last_sentence[last_comma_index+2:].strip()
+        phrase_start = last_comma_index + 2
+        while text[phrase_start].isspace():
+            phrase_start += 1
         # Format: Text before + [linked phrase](link) + punctuation
-        return f"{text_before_sentence}{text_before_phrase}[{linked_phrase}]({url}){trailing_punctuation}"
+        return (
+            f"{text_before_sentence}{text[sentence_start:last_comma_index+2]}"
+            f"[{text[phrase_start:end]}]({url}){trailing_punctuation}"
+        )
     else:
         # If no comma, link the whole last sentence
-        return f"{text_before_sentence}[{last_sentence}]({url}){trailing_punctuation}"
+        return f"{text_before_sentence}[{text[sentence_start:end]}]({url}){trailing_punctuation}"
+
+def insert_end_of_report_separator(markdown_content):
+    """Inserts '---' before each "End of Report" phrase, matching case-insensitively."""
+    lowered = markdown_content.lower()
+    if len(lowered) != len(markdown_content):
+        # Non-ASCII case folding shifted the indices; fall back to the regex.
+        return _EOR_RE.sub(r'---\n\nEnd of Report', markdown_content)
+
+    idx = lowered.find("end of report")
+    if idx == -1:
+        return markdown_content
+
+    # Splice the separator in with plain string scans instead of the regex engine
+    parts = []
+    start = 0
+    while idx != -1:
+        parts.append(markdown_content[start:idx])
+        parts.append("---\n\nEnd of Report")
+        start = idx + len("end of report")
+        idx = lowered.find("end of report", start)
+    parts.append(markdown_content[start:])
+    return "".join(parts)
 
 def format_latex_in_markdown(markdown_content):
     """Formats LaTeX equations with double backslashes and escaped underscores."""
     def format_latex_match(match):
         latex_content = match.group(0)
+        # Nothing to escape
+        if '\\' not in latex_content and '_' not in latex_content:
+            return latex_content
         # Double backslashes
         latex_content = latex_content.replace('\\', '\\\\')
         # Escape underscores (only if not already escaped)
-        latex_content = re.sub(r'(?<!\\)_', r'\\_', latex_content)
+        latex_content = _UNDERSCORE_RE.sub(r'\\_', latex_content)
         return latex_content
 
     # Apply format within display math blocks ($$...$$)
-    markdown_content = re.sub(r'\$\$.*?\$\$', format_latex_match, markdown_content, flags=re.DOTALL)
+    # Cheap membership tests skip the regex scans for documents without LaTeX
+    if '$$' in markdown_content:
+        markdown_content = _DISPLAY_MATH_RE.sub(format_latex_match, markdown_content)
 
     # Apply format to inline LaTeX patterns containing backslashes, e.g., |...|
     # This handles the specific notation seen in the example: $|\nabla \mathcal{L}|$
-    markdown_content = re.sub(r'\|.*?\\.*?\|', format_latex_match, markdown_content, flags=re.DOTALL)
+    if '|' in markdown_content and '\\' in markdown_content:
+        markdown_content = _INLINE_MATH_RE.sub(format_latex_match, markdown_content)
 
     return markdown_content
 
 # --- Core Processing Logic ---
 
+def _first_link(footnote):
+    """Returns the first linked URL in a footnote, or None if it has no link."""
+    # Footnotes are structured similarly to the main body content
+    for element in footnote.get('content', ()):
+        paragraph = element.get('paragraph')
+        if not paragraph:
+            continue
+        for p_element in paragraph.get('elements', ()):
+            text_run = p_element.get('textRun')
+            if text_run is None:
+                continue
+            text_style = text_run.get('textStyle')
+            if text_style is None:
+                continue
+            link = text_style.get('link')
+            if link is None:
+                continue
+            url = link.get('url')
+            if url:
+                # Assume only one primary link per footnote
+                return url
+    return None
+
 def extract_footnote_links(doc):
     """Maps footnote IDs to their URLs by parsing the 'footnotes' section of the API response."""
-    footnote_links = {}
-    if 'footnotes' not in doc:
-        return footnote_links
-
-    # Footnotes are structured similarly to the main body content
-    for footnote_id, footnote in doc['footnotes'].items():
-        for element in footnote.get('content', []):
-            if 'paragraph' in element:
-                for p_element in element['paragraph'].get('elements', []):
-                    text_run = p_element.get('textRun')
-                    # Check if the text run contains a link style
-                    if text_run and 'textStyle' in text_run and 'link' in text_run['textStyle']:
-                        url = text_run['textStyle']['link'].get('url')
-                        if url:
-                            footnote_links[footnote_id] = clean_google_url(url)
-                            # Assume only one primary link per footnote, break after finding it
-                            break
-                if footnote_id in footnote_links:
-                    break
-    return footnote_links
+    return {
+        footnote_id: clean_google_url(url)
+        for footnote_id, footnote in doc.get('footnotes', {}).items()
+        if (url := _first_link(footnote))
+    }
 
 def process_paragraph(paragraph, footnote_links):
     """Processes a paragraph element, handling text runs and footnote references."""
-    content = ""
+    content_parts = []
     # Buffer text runs to know what precedes a footnote reference
-    text_buffer = ""
+    text_buffer_parts = []
+
+    # Bind the hot lookups once, outside the loop
+    footnote_links_get = footnote_links.get
+    append_text = text_buffer_parts.append
 
     for element in paragraph.get('elements', []):
-        if 'textRun' in element:
+        text_run = element.get('textRun')
+        if text_run is not None:
             # Accumulate text content
-            text = element['textRun'].get('content', '')
+            text = text_run.get('content', '')
             # We accumulate all text, including spaces, but avoid the final newline character of the paragraph
             if text != '\n':
-                 text_buffer += text
-
-        elif 'footnoteReference' in element:
-            footnote_id = element['footnoteReference'].get('footnoteId')
-            if footnote_id in footnote_links:
-                link = footnote_links[footnote_id]
-
+                 append_text(text)
+            continue
+
+        footnote_ref = element.get('footnoteReference')
+        if footnote_ref is not None:
+            text_buffer = ''.join(text_buffer_parts)
+            text_buffer_parts.clear() # Clear buffer after flushing
+            link = footnote_links_get(footnote_ref.get('footnoteId'))
+            if link is not None:
                 # Apply heuristic to the buffered text
-                content += apply_linking_heuristic(text_buffer, link)
-                text_buffer = "" # Clear buffer after linking
+                content_parts.append(apply_linking_heuristic(text_buffer, link))
             else:
                 # Fallback if link not found: append buffer and the superscript number
-                content += text_buffer + f"^{element['footnoteReference'].get('footnoteNumber', '')}"
-                text_buffer = ""
+                content_parts.append(text_buffer + f"^{footnote_ref.get('footnoteNumber', '')}")
 
     # Append any remaining text in the buffer
-    content += text_buffer
+    content = ''.join(content_parts) + ''.join(text_buffer_parts)
 
     # Determine paragraph style
-    p_style = paragraph.get('paragraphStyle', {}).get('namedStyleType', 'NORMAL_TEXT')
+    # Interning makes lookups and comparisons against the (already interned)
+    # style-name literals hit the identity fast path instead of comparing characters.
+    p_style = sys.intern(paragraph.get('paragraphStyle', {}).get('namedStyleType', 'NORMAL_TEXT'))
 
     final_content = content.strip()
 
     # Stop processing if this paragraph is the "Works Cited" heading
-    if re.match(r'^(Works cited|References|Bibliography)\s*$', final_content, re.IGNORECASE):
-        return None, p_style, True # Signal to stop
+    if final_content.lower().rstrip() in _STOP_HEADINGS:
+        return _STOP, p_style # Signal to stop
 
     if not final_content:
-        return "", p_style, False
+        return "", p_style
 
     # Format as Markdown
-    if p_style.startswith('HEADING_'):
-        try:
-            level = int(p_style.split('_')[1])
-            # Google Docs often uses H1 for the main title
-            if level == 1:
-                 prefix = "#"
-            else:
-                 prefix = "#" * level
-            return f"{prefix} {final_content}\n\n", p_style, False
-        except (IndexError, ValueError):
-            # Fallback if heading format is unexpected
-            return f"{final_content}\n\n", p_style, False
-    elif p_style == 'TITLE':
-        return f"# {final_content}\n\n", p_style, False
-    else:
-        return f"{final_content}\n\n", p_style, False
+    prefix = _HEADING_PREFIX.get(p_style)
+    if prefix:
+        return f"{prefix} {final_content}\n\n", p_style
+    return f"{final_content}\n\n", p_style
+
+def postprocess_markdown(markdown_content):
+    """Applies the separator, newline and LaTeX cleanups to a block of converted paragraphs."""
+    # Handle "End of Report" separator
+    # Insert '---' before "End of Report" if that specific phrase exists.
+    markdown_content = insert_end_of_report_separator(markdown_content)
 
-def convert_doc_to_markdown(doc):
-    """Converts the Google Doc API response to Markdown."""
+    # Clean excessive newlines; each pass shortens every run of 3+ by a third
+    while '\n\n\n' in markdown_content:
+        markdown_content = markdown_content.replace('\n\n\n', '\n\n')
+
+    # Apply LaTeX formatting
+    return format_latex_in_markdown(markdown_content)
+
+def convert_doc_to_markdown(doc, out):
+    """Converts the Google Doc API response to Markdown, streaming it to the text file `out`."""
     footnote_links = extract_footnote_links(doc)
-    markdown_output = ""
+
+    # Paragraphs are written as soon as they are converted. Each write is preceded by
+    # the blank line separating it from the previous one, so the output has no
+    # leading or trailing whitespace.
+    separator = ""
+    # Paragraphs held back while a $$...$$ block spanning paragraphs is still open
+    pending = []
+    math_open = False
+
+    def flush():
+        nonlocal separator
+        out.write(separator)
+        out.write(postprocess_markdown("\n\n".join(pending)))
+        pending.clear()
+        separator = "\n\n"
 
     body_content = doc.get('body', {}).get('content', [])
 
@@ -223,77 +356,136 @@ def convert_doc_to_markdown(doc):
 
     for element in body_content:
         if 'paragraph' in element:
-            md_text, style, stop_processing = process_paragraph(element['paragraph'], footnote_links)
+            md_text, style = process_paragraph(element['paragraph'], footnote_links)
+            if md_text is _STOP:
+                break
 
             if md_text:
-                markdown_output += md_text
+                pending.append(md_text.rstrip())
+                if md_text.count('$$') % 2:
+                    math_open = not math_open
 
                 # Heuristic for Horizontal Rule (---):
                 # The API does not reliably expose "Horizontal Line". We infer it based on structure.
                 # Insert '---' after the main title (TITLE style or the first H1).
                 if not title_separator_added:
                     if style == 'TITLE' or style == 'HEADING_1':
-                        markdown_output += "---\n\n"
+                        pending.append("---")
                         title_separator_added = True
 
-            if stop_processing:
-                break
+                if not math_open:
+                    flush()
 
         # (Add handling for Tables, Images, Lists etc., if necessary for future enhancements)
 
-    # Final cleanup
-    markdown_output = markdown_output.strip()
-
-    # Post-processing: Handle "End of Report" separator
-    # Insert '---' before "End of Report" if that specific phrase exists.
-    # Use regex to ensure it's replaced correctly even if case differs slightly.
-    markdown_output = re.sub(r'End of Report', r'---\n\nEnd of Report', markdown_output, flags=re.IGNORECASE)
-
-    # Clean excessive newlines
-    markdown_output = re.sub(r'\n{3,}', '\n\n', markdown_output)
-
-    # Apply LaTeX formatting
-    markdown_output = format_latex_in_markdown(markdown_output)
-
-    return markdown_output
+    # Write out anything left behind an unterminated $$
+    if pending:
+        flush()
 
 
 # --- Execution ---
 
+def fetch_documents(service, document_ids):
+    """Fetches several documents in a single batched HTTP request.
+
+    Returns a dict mapping each document ID to its response, or to the HttpError raised for it.
+    """
+    results = {}
+
+    def callback(request_id, response, exception):
+        results[request_id] = exception if exception is not None else response
+
+    batch = service.new_batch_http_request(callback=callback)
+    for document_id in document_ids:
+        batch.add(
+            service.documents().get(documentId=document_id, fields=DOC_FIELDS),
+            request_id=document_id,
+        )
+    batch.execute()
+    return results
+
+# Per-thread HTTP connections; httplib2.Http objects are not thread-safe
+_THREAD_LOCAL = threading.local()
+
+def _thread_http():
+    """Returns an authorized HTTP connection owned by the calling thread."""
+    http = getattr(_THREAD_LOCAL, 'http', None)
+    if http is None:
+        http = google_auth_httplib2.AuthorizedHttp(authenticate(), http=httplib2.Http())
+        _THREAD_LOCAL.http = http
+    return http
+
+def fetch_and_convert(document_id, service):
+    """Fetches one document and returns its title and Markdown. Safe to call from worker threads."""
+    document = service.documents().get(
+        documentId=document_id, fields=DOC_FIELDS
+    ).execute(http=_thread_http())
+    out = io.StringIO()
+    convert_doc_to_markdown(document, out)
+    return document.get('title'), out.getvalue()
+
+def report_http_error(err):
+    """Prints a readable explanation of a Docs API HTTP error."""
+    print(f"\nHTTP error occurred: {err}")
+    if err.resp.status == 404:
+        print("Error 404: Document not found. Check the ID and ensure you have access.")
+    elif err.resp.status == 403:
+        print("Error 403: Permission denied. Ensure the account used has access to this document.")
+    elif err.resp.status == 401:
+        print("Error 401: Unauthorized. Credentials may be invalid or expired.")
+
 def main(document_id):
     """Fetches the document via the API and converts it."""
-    print("Starting authentication process...")
-    creds = authenticate()
-    if not creds:
+    print("Connecting to Google Docs API...")
+    service = get_service()
+    if not service:
         print("Authentication failed. Exiting.")
         return
 
     try:
-        print(f"Connecting to Google Docs API...")
-        service = build("docs", "v1", credentials=creds)
-
         print(f"Fetching document ID: {document_id}...")
         # Retrieve the documents contents from the Docs service.
-        document = service.documents().get(documentId=document_id).execute()
+        document = service.documents().get(documentId=document_id, fields=DOC_FIELDS).execute()
 
         print("Document fetched. Processing content...")
-        final_markdown = convert_doc_to_markdown(document)
+        print(f"\nDocument Title: {document.get('title')}\n")
+        convert_doc_to_markdown(document, sys.stdout)
+        print()
 
         print("\n--- Conversion Successful ---")
-        print(f"Document Title: {document.get('title')}\n")
-        print(final_markdown)
 
     except HttpError as err:
-        print(f"\nHTTP error occurred: {err}")
-        if err.resp.status == 404:
-            print("Error 404: Document not found. Check the ID and ensure you have access.")
-        elif err.resp.status == 403:
-            print("Error 403: Permission denied. Ensure the account used has access to this document.")
-        elif err.resp.status == 401:
-            print("Error 401: Unauthorized. Credentials may be invalid or expired.")
+        report_http_error(err)
     except Exception as e:
         print(f"\nAn unexpected error occurred: {e}")
 
+def main_many(document_ids, max_workers=8):
+    """Fetches and converts several documents concurrently, printing them in the given order."""
+    print("Connecting to Google Docs API...")
+    service = get_service()
+    if not service:
+        print("Authentication failed. Exiting.")
+        return
+
+    # Fetching is I/O-bound, so threads overlap the network round-trips.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            (document_id, executor.submit(fetch_and_convert, document_id, service))
+            for document_id in document_ids
+        ]
+        for document_id, future in futures:
+            print(f"\n=== Document ID: {document_id} ===")
+            try:
+                title, markdown = future.result()
+            except HttpError as err:
+                report_http_error(err)
+                continue
+            except Exception as e:
+                print(f"\nAn unexpected error occurred: {e}")
+                continue
+            print(f"Document Title: {title}\n")
+            print(markdown)
+
 if __name__ == "__main__":
     # The ID from the example URL provided:
     # https://docs.google.com/document/d/1fyO2F0M6fPPsKrEsI13paQOVWI655NEzsLTOhQd5kl4/edit?usp=sharing